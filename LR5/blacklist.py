@@ -0,0 +1,335 @@
+import datetime
+import heapq
+import os
+import re
+import threading
+import time
+
+import pandas as pd
+
+BLACK_LIST_FILE = 'bad_boys2.csv'
+# Как часто (не чаще раза в N секунд) проверять mtime файла черного списка
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+# Неизменяемый снимок черного списка; при перезагрузке подменяется целиком одной ссылкой
+class BlacklistSnapshot:
+    def __init__(self, frame, mtime):
+        # Фамилии как в файле - для black_list_check (сравнение с учетом регистра, как раньше)
+        self.surnames = set(frame['Surname'])
+        # Нормализованные строки (ФИО с заглавной буквы) в порядке файла
+        self.rows = list(zip(frame['Surname'].str.title(), frame['Name'].str.title(),
+                             frame['Patronym'].str.title(), frame['Birth']))
+        self.full_keys = set(self.rows)
+        # Разбиение по дате рождения: нечеткий поиск идет только внутри своей даты
+        # (строки - для проверок, номера строк - для search)
+        self.by_birth = {}
+        self.birth_positions = {}
+        # Номера строк по фамилии и BK-дерево различных фамилий (строится при первом поиске)
+        self.by_surname = {}
+        for position, row in enumerate(self.rows):
+            self.by_birth.setdefault(row[3], []).append(row)
+            self.birth_positions.setdefault(row[3], []).append(position)
+            self.by_surname.setdefault(row[0], []).append(position)
+        self.surname_tree = None
+        self.tree_lock = threading.Lock()
+        self.mtime = mtime
+        self.loaded_at = datetime.datetime.now()
+
+    def get_surname_tree(self):
+        with self.tree_lock:
+            if self.surname_tree is None:
+                self.surname_tree = BKTree(self.by_surname)
+            return self.surname_tree
+
+
+# BK-дерево по расстоянию Левенштейна: поиск слов в радиусе r без перебора всего словаря
+class BKTree:
+    def __init__(self, words):
+        self.root = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            distance = levenshtein_distance(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                return
+            node = child
+
+    # [(расстояние, слово)] для всех слов на расстоянии не больше radius
+    def search(self, word, radius):
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_word, children = stack.pop()
+            distance = levenshtein_distance(word, node_word)
+            if distance <= radius:
+                found.append((distance, node_word))
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+# Индекс черного списка в памяти с горячей перезагрузкой при изменении файла
+class BlacklistIndex:
+    def __init__(self, csv_file=BLACK_LIST_FILE):
+        self.csv_file = csv_file
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = 0.0
+        self.reloads = 0
+
+    # Актуальный снимок (читатели работают со ссылкой на снимок без блокировок)
+    def get(self):
+        if self.snapshot is None or time.monotonic() - self.checked_at >= RELOAD_CHECK_INTERVAL:
+            self.refresh()
+        return self.snapshot
+
+    # Перечитать файл, если изменился его mtime
+    def refresh(self):
+        with self.lock:
+            self.checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.csv_file).st_mtime_ns
+                if self.snapshot is not None and self.snapshot.mtime == mtime:
+                    return False
+                frame = pd.read_csv(self.csv_file, header=0, sep=',', encoding='utf-8', dtype=str).fillna('')
+                self.snapshot = BlacklistSnapshot(frame, mtime)
+            except (OSError, ValueError, KeyError) as e:
+                # Файл недоступен или записан не до конца - остаемся на прежнем снимке
+                if self.snapshot is None:
+                    raise
+                print(f"Ошибка перезагрузки черного списка: {e}")
+                return False
+            self.reloads += 1
+            return True
+
+    # Размер индекса и время последней перезагрузки
+    def info(self):
+        snapshot = self.get()
+        return {
+            "file": self.csv_file,
+            "rows": len(snapshot.rows),
+            "birth_partitions": len(snapshot.by_birth),
+            "surnames": len(snapshot.surnames),
+            "full_keys": len(snapshot.full_keys),
+            "loaded_at": snapshot.loaded_at.strftime('%Y-%m-%d %H:%M:%S'),
+            "reloads": self.reloads
+        }
+
+
+# Индексы по файлам; в каждом процессе (в том числе в пуле) свои
+indexes = {}
+indexes_lock = threading.Lock()
+
+
+def get_index(csv_file=BLACK_LIST_FILE):
+    with indexes_lock:
+        if csv_file not in indexes:
+            indexes[csv_file] = BlacklistIndex(csv_file)
+        return indexes[csv_file]
+
+
+# Расстояние Левенштейна с ограничением: считаем только полосу шириной max_distance вокруг диагонали
+# и прекращаем, как только вся строка матрицы превысила порог. Результат - точное расстояние,
+# если оно не больше max_distance, иначе max_distance + 1
+def bounded_levenshtein(s1, s2, max_distance):
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+    over = max_distance + 1
+    if len(s1) - len(s2) > max_distance:
+        return over
+    if s1 == s2:
+        return 0
+
+    previous_row = [j if j <= max_distance else over for j in range(len(s2) + 1)]
+    for i, c1 in enumerate(s1, 1):
+        lo = max(1, i - max_distance)
+        hi = min(len(s2), i + max_distance)
+        current_row = [over] * (len(s2) + 1)
+        current_row[0] = i if i <= max_distance else over
+        row_min = current_row[0]
+        for j in range(lo, hi + 1):
+            value = min(previous_row[j] + 1, current_row[j - 1] + 1, previous_row[j - 1] + (c1 != s2[j - 1]))
+            current_row[j] = value if value <= max_distance else over
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return over
+        previous_row = current_row
+    return previous_row[-1]
+
+
+def levenshtein_distance(s1, s2):
+    return bounded_levenshtein(s1, s2, max(len(s1), len(s2)))
+
+
+# Проверка формата даты рождения: текст ошибки или None
+def validate_birth_date(birth_date):
+    date_pattern = r'^\d{2}\.\d{2}\.\d{4}$'
+    if not re.match(date_pattern, birth_date):
+        return f"Ошибка: Неверный формат даты '{birth_date}'. Ожидается DD.MM.YYYY (например, 22.03.1989)"
+    try:
+        input_date = datetime.datetime.strptime(birth_date, '%d.%m.%Y')
+        current_date = datetime.datetime.now()
+        if input_date > current_date:
+            return f"Ошибка: Дата рождения '{birth_date}' не может быть позже текущей даты"
+    except ValueError:
+        return f"Ошибка: Неверная дата '{birth_date}'. Проверьте корректность"
+    return None
+
+
+# Похожие строки: та же дата рождения (в порядке файла), каждое поле ФИО отличается не больше чем на 1
+def find_similar(snapshot, surname, name, patronym, birth_date):
+    return [row for row in snapshot.by_birth.get(birth_date, ())
+            if bounded_levenshtein(row[0], surname, 1) <= 1 and
+            bounded_levenshtein(row[1], name, 1) <= 1 and
+            bounded_levenshtein(row[2], patronym, 1) <= 1]
+
+
+# Проверка фамилии по черному списку
+def check_surname(sname, csv_file=BLACK_LIST_FILE):
+    return sname in get_index(csv_file).get().surnames
+
+
+# Проверка по ФИО и дате рождения с допуском в одну букву: (ответ, строка для лога)
+def check_full(surname, name, patronym, birth_date, csv_file=BLACK_LIST_FILE):
+    message = validate_birth_date(birth_date)
+    if message is not None:
+        return message, f"black_list_check_full ERROR: {message}"
+
+    snapshot = get_index(csv_file).get()
+
+    surname_input = surname.title()
+    name_input = name.title()
+    patronym_input = patronym.title()
+
+    if (surname_input, name_input, patronym_input, birth_date) in snapshot.full_keys:
+        return (f"{surname_input} {name_input} {patronym_input} ({birth_date}): yes good boy",
+                "black_list_check_full RES: yes good boy")
+
+    similar_list = [f"{row_surname} {row_name} {row_patronym} ({row_birth})"
+                    for row_surname, row_name, row_patronym, row_birth
+                    in find_similar(snapshot, surname_input, name_input, patronym_input, birth_date)]
+
+    if similar_list:
+        return f"{', '.join(similar_list)}: similar good boy", "black_list_check_full RES: similar good boy"
+    return (f"{surname_input} {name_input} {patronym_input} ({birth_date}): no, bad boy",
+            "black_list_check_full RES: no, bad boy")
+
+
+# Пакетная проверка списка (фамилия, имя, отчество, дата рождения).
+# Даты проверяются один раз на каждую уникальную дату, точные совпадения - пересечением множеств.
+# Для каждой записи: status = exact / similar / clear / error, для similar - список совпадений
+def check_batch(records, csv_file=BLACK_LIST_FILE):
+    snapshot = get_index(csv_file).get()
+
+    keys = []
+    for record in records:
+        if not (isinstance(record, (list, tuple)) and len(record) == 4
+                and all(isinstance(field, str) for field in record)):
+            keys.append(None)
+        else:
+            surname, name, patronym, birth_date = record
+            keys.append((surname.title(), name.title(), patronym.title(), birth_date))
+
+    date_errors = {birth_date: validate_birth_date(birth_date) for birth_date in {key[3] for key in keys if key}}
+    exact = {key for key in keys if key} & snapshot.full_keys
+
+    results = []
+    for key in keys:
+        if key is None:
+            results.append({"status": "error", "error": "Ожидается (фамилия, имя, отчество, дата рождения)"})
+            continue
+        result = {"surname": key[0], "name": key[1], "patronym": key[2], "birth": key[3]}
+        if date_errors[key[3]] is not None:
+            result.update(status="error", error=date_errors[key[3]])
+        elif key in exact:
+            result["status"] = "exact"
+        else:
+            matches = find_similar(snapshot, *key)
+            if matches:
+                result.update(status="similar", matches=[
+                    {"surname": row[0], "name": row[1], "patronym": row[2], "birth": row[3]} for row in matches])
+            else:
+                result["status"] = "clear"
+        results.append(result)
+    return results
+
+
+# k ближайших записей черного списка к запросу [фамилия, имя, отчество] или [..., дата рождения]
+# (или словарь с ключами surname/name/patronym/birth). Каждое поле отличается не больше чем на
+# max_distance, score - сумма расстояний по полям. Когда k лучших уже набраны, строка отбрасывается,
+# как только ее частичная сумма не оставляет шанса попасть в top-k
+def search(query, max_distance=1, k=10, csv_file=BLACK_LIST_FILE):
+    if isinstance(query, dict):
+        query = [query.get(field, '') for field in ('surname', 'name', 'patronym')] + \
+                ([query['birth']] if query.get('birth') else [])
+    if len(query) not in (3, 4):
+        raise ValueError("Ожидается [фамилия, имя, отчество] или [фамилия, имя, отчество, дата рождения]")
+    if not 0 <= max_distance <= 5 or k < 1:
+        raise ValueError("max_distance должен быть от 0 до 5, k - не меньше 1")
+    surname, name, patronym = (field.title() for field in query[:3])
+    birth_date = query[3] if len(query) == 4 else None
+    if birth_date is not None:
+        message = validate_birth_date(birth_date)
+        if message is not None:
+            raise ValueError(message)
+
+    snapshot = get_index(csv_file).get()
+    # Кандидаты (расстояние по фамилии или None, номер строки); с датой - только ее раздел,
+    # без даты - фамилии из BK-дерева, ближайшие первыми, чтобы порог top-k сужался быстрее
+    if birth_date is not None:
+        candidates = [(None, position) for position in snapshot.birth_positions.get(birth_date, ())]
+    else:
+        candidates = sorted((distance, position)
+                            for distance, word in snapshot.get_surname_tree().search(surname, max_distance)
+                            for position in snapshot.by_surname[word])
+
+    # Max-куча по (score, номер строки) через отрицание: на вершине худший из текущих top-k
+    heap = []
+    for surname_distance, position in candidates:
+        row = snapshot.rows[position]
+        # Допустимая сумма: при заполненной куче (score, номер строки) строго меньше, чем у худшего из top-k
+        # (кандидаты из BK-дерева идут не по номеру строки, поэтому сравниваем пару, а не только score)
+        if len(heap) < k:
+            limit = 3 * max_distance
+        else:
+            limit = -heap[0][0] if position < -heap[0][1] else -heap[0][0] - 1
+        distances = []
+        score = 0
+        for field_index, (value, known) in enumerate(((surname, surname_distance), (name, None), (patronym, None))):
+            budget = min(max_distance, limit - score)
+            if budget < 0:
+                break
+            distance = known if known is not None else bounded_levenshtein(row[field_index], value, budget)
+            if distance > budget:
+                break
+            distances.append(distance)
+            score += distance
+        else:
+            entry = (-score, -position, distances)
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heapreplace(heap, entry)
+
+    results = []
+    for neg_score, neg_position, distances in sorted(heap, key=lambda e: (-e[0], -e[1])):
+        row = snapshot.rows[-neg_position]
+        results.append({
+            "surname": row[0], "name": row[1], "patronym": row[2], "birth": row[3],
+            "distances": {"surname": distances[0], "name": distances[1], "patronym": distances[2]},
+            "score": -neg_score
+        })
+    return results
@@ -0,0 +1,126 @@
+import select
+import threading
+import time
+import xmlrpc.client
+from contextlib import contextmanager
+
+from pooled_server import POOLED_CONNECTION_HEADER
+
+
+# Transport с одним постоянным HTTP/1.1 соединением (стандартный Transport уже умеет keep-alive,
+# но один экземпляр нельзя делить между потоками). Помнит время последнего использования.
+# Воркер держит соединение открытым только по заголовку POOLED_CONNECTION_HEADER
+class KeepAliveTransport(xmlrpc.client.Transport):
+    def __init__(self):
+        super().__init__()
+        self.last_used = time.monotonic()
+
+    def send_headers(self, connection, headers):
+        super().send_headers(connection, headers)
+        connection.putheader(POOLED_CONNECTION_HEADER, '1')
+
+    # Соединение еще пригодно: не закрыто сервером и не простаивало дольше idle_timeout.
+    # Читаемый в простое сокет означает, что сервер закрыл соединение (EOF) или прислал лишнее
+    def is_healthy(self, idle_timeout):
+        if time.monotonic() - self.last_used > idle_timeout:
+            return False
+        conn = self._connection[1]
+        if conn is None or conn.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+
+# Пул постоянных соединений к одному воркеру: не больше max_size одновременно,
+# свободные соединения проверяются перед выдачей, сломанные закрываются
+class WorkerConnectionPool:
+    def __init__(self, addr, max_size=4, idle_timeout=0.3):
+        self.addr = addr
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.idle = []
+        self.total = 0
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def create(self):
+        transport = KeepAliveTransport()
+        return xmlrpc.client.ServerProxy(f"http://{self.addr}", transport=transport, allow_none=True), transport
+
+    # Свободное соединение или новое, если пул не заполнен; иначе ждем освобождения
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise ConnectionError(f"Пул соединений {self.addr} закрыт")
+                while self.idle:
+                    proxy, transport = self.idle.pop()
+                    if transport.is_healthy(self.idle_timeout):
+                        self.reused += 1
+                        return proxy, transport
+                    transport.close()
+                    self.total -= 1
+                    self.discarded += 1
+                if self.total < self.max_size:
+                    self.total += 1
+                    self.created += 1
+                    return self.create()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Нет свободных соединений к {self.addr}")
+                self.condition.wait(remaining)
+
+    # Возврат соединения; после сетевой ошибки оно закрывается, чтобы не выдать его снова
+    def release(self, proxy, transport, healthy=True):
+        with self.condition:
+            if healthy and not self.closed:
+                transport.last_used = time.monotonic()
+                self.idle.append((proxy, transport))
+            else:
+                transport.close()
+                self.total -= 1
+                self.discarded += 1
+            self.condition.notify()
+
+    # with pool.connection() as worker_proxy: worker_proxy.method(...)
+    # Fault - ответ воркера, соединение исправно; остальные ошибки - соединение закрывается
+    @contextmanager
+    def connection(self, timeout=None):
+        proxy, transport = self.acquire(timeout)
+        healthy = False
+        try:
+            yield proxy
+            healthy = True
+        except xmlrpc.client.Fault:
+            healthy = True
+            raise
+        finally:
+            self.release(proxy, transport, healthy)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            for _, transport in self.idle:
+                transport.close()
+            self.total -= len(self.idle)
+            self.idle = []
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "max_size": self.max_size,
+                "open": self.total,
+                "idle": len(self.idle),
+                "in_use": self.total - len(self.idle),
+                "created": self.created,
+                "reused": self.reused,
+                "discarded": self.discarded
+            }
@@ -1,25 +1,40 @@
+import glob
 import os
 import sqlite3
 
 import pandas as pd
 import streamlit as st
 
-DB_FILE = '../logs/log.db'
+# Журнал разбит по дням: ../logs/log-YYYY-MM-DD.db
+LOG_DIR = '../logs'
+
+
+# Файлы журнала по дням [(день, путь)], пересекающиеся с интервалом дат
+def list_partitions(start_day=None, end_day=None):
+    partitions = []
+    for path in glob.glob(os.path.join(LOG_DIR, 'log-*.db')):
+        day = os.path.basename(path)[len('log-'):-len('.db')]
+        if (start_day and day < start_day) or (end_day and day > end_day):
+            continue
+        partitions.append((day, path))
+    return sorted(partitions)
 
 
 # Проверка существования БД
 def check_db():
-    if not os.path.exists(DB_FILE):
-        raise FileNotFoundError(f"База данных не найдена: {DB_FILE}")
+    if not list_partitions():
+        raise FileNotFoundError(f"База данных не найдена: {LOG_DIR}/log-*.db")
 
 
-# Получить все типы операций из БД
+# Получить все типы операций из БД (по часовым агрегатам - они есть и для сжатых дней)
 @st.cache_data(ttl=300)
 def get_event_types():
     try:
-        with sqlite3.connect(DB_FILE) as db:
-            df = pd.read_sql_query("SELECT DISTINCT event_type FROM logs ORDER BY event_type", db)
-            return df['event_type'].tolist()
+        event_types = set()
+        for day, path in list_partitions():
+            with sqlite3.connect(path) as db:
+                event_types.update(row[0] for row in db.execute("SELECT DISTINCT event_type FROM rollup_hour"))
+        return sorted(event_types)
     except Exception as e:
         st.error(f"Ошибка получения типов событий: {e}")
         return []
@@ -29,34 +44,48 @@ def get_event_types():
 @st.cache_data(ttl=60)
 def load_logs(params):
     try:
-        with sqlite3.connect(DB_FILE) as db:
-            query = "SELECT id, event_type, timestamp, duration FROM logs WHERE 1=1"
-            args = []
+        query = "SELECT id, event_type, timestamp, duration FROM logs WHERE 1=1"
+        args = []
 
-            if params['event_type']:
-                query += " AND event_type = ?"
-                args.append(params['event_type'])
+        if params['event_type']:
+            query += " AND event_type = ?"
+            args.append(params['event_type'])
 
-            query += " AND timestamp >= ?"
-            args.append(params['start_datetime'].strftime('%Y-%m-%d %H:%M:%S'))
+        start = params['start_datetime'].strftime('%Y-%m-%d %H:%M:%S')
+        query += " AND timestamp >= ?"
+        args.append(start)
 
-            query += " AND timestamp <= ?"
-            args.append(params['end_datetime'].strftime('%Y-%m-%d %H:%M:%S'))
+        end = params['end_datetime'].strftime('%Y-%m-%d %H:%M:%S')
+        query += " AND timestamp <= ?"
+        args.append(end)
 
-            if params['min_duration'] is not None:
-                query += " AND (duration IS NOT NULL AND duration >= ?)"
-                args.append(params['min_duration'])
+        if params['min_duration'] is not None:
+            query += " AND (duration IS NOT NULL AND duration >= ?)"
+            args.append(params['min_duration'])
 
-            if params['max_duration'] is not None:
-                query += " AND (duration IS NOT NULL AND duration <= ?)"
-                args.append(params['max_duration'])
+        if params['max_duration'] is not None:
+            query += " AND (duration IS NOT NULL AND duration <= ?)"
+            args.append(params['max_duration'])
 
-            query += " ORDER BY timestamp DESC"
-            if params['limit']:
-                query += " LIMIT ?"
-                args.append(params['limit'])
+        query += " ORDER BY timestamp DESC"
+        if params['limit']:
+            query += " LIMIT ?"
+            args.append(params['limit'])
 
-            df = pd.read_sql_query(query, db, params=args)
+        # Новые дни первыми: при лимите старые файлы можно не открывать
+        frames = []
+        rows = 0
+        for day, path in reversed(list_partitions(start[:10], end[:10])):
+            with sqlite3.connect(path) as db:
+                frames.append(pd.read_sql_query(query, db, params=args))
+            rows += len(frames[-1])
+            if params['limit'] and rows >= params['limit']:
+                break
+        if not frames:
+            return pd.DataFrame(columns=['id', 'event_type', 'timestamp', 'duration'])
+        df = pd.concat(frames, ignore_index=True)
+        if params['limit']:
+            df = df.head(params['limit'])
         return df
     except Exception as e:
         st.error(f"Ошибка чтения БД: {e}")
@@ -0,0 +1,147 @@
+import hashlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# Количество каналов изображения: (M, N) -> 1, (M, N, C) -> C
+def image_channels(img_arr):
+    return img_arr.shape[2] if img_arr.ndim > 2 else 1
+
+
+# Инверсия цвета целым массивом (RGB/RGBA - первые три канала, альфа не трогаем; иначе - канал 0)
+def invert_image(img_arr):
+    if not img_arr.flags.writeable:
+        img_arr = img_arr.copy()
+    channels = image_channels(img_arr)
+    if img_arr.ndim == 2:
+        view = img_arr
+    elif channels in (3, 4):
+        view = img_arr[..., :3]
+    else:
+        view = img_arr[..., :1]
+
+    if img_arr.dtype == np.uint8:
+        np.subtract(255, view, out=view)
+    else:
+        # Считаем в более широком типе и приводим обратно, как это делало поэлементное присваивание
+        work_dtype = np.promote_types(img_arr.dtype, np.int16) if img_arr.dtype.kind in 'biu' else img_arr.dtype
+        np.subtract(255, view, out=view, dtype=work_dtype, casting='unsafe')
+    return img_arr
+
+
+# Бинаризация целым массивом, возвращает (маска uint8, процент пикселей не ниже порога)
+def binarize_image(img_arr, threshold):
+    if img_arr.max() <= 1.0:
+        img_arr = (img_arr * 255).astype(np.uint8)
+    else:
+        img_arr = img_arr.astype(np.uint8, copy=False)
+
+    channels = image_channels(img_arr)
+    binarized_arr = np.zeros_like(img_arr, dtype=np.uint8)
+    total_pixels = img_arr.shape[0] * img_arr.shape[1]
+
+    if img_arr.ndim == 2:
+        mask = img_arr >= threshold
+        binarized_arr[mask] = 255
+    elif channels in (3, 4):
+        # Сумма в uint8 переполняется так же, как в прежнем попиксельном варианте
+        avg = (img_arr[..., 0] + img_arr[..., 1] + img_arr[..., 2]) // 3
+        mask = avg >= threshold
+        binarized_arr[..., :3][mask] = 255
+        if channels == 4:
+            binarized_arr[..., 3] = img_arr[..., 3]
+    elif channels in (1, 2):
+        # Оттенки серого, для (M, N, 2) второй канал - альфа
+        mask = img_arr[..., 0] >= threshold
+        binarized_arr[..., 0][mask] = 255
+        if channels == 2:
+            binarized_arr[..., 1] = img_arr[..., 1]
+    else:
+        return binarized_arr, 0.0
+
+    cloud_percentage = (int(np.count_nonzero(mask)) / total_pixels) * 100
+    return binarized_arr, cloud_percentage
+
+
+# Разворот изображения относительно вертикали (зеркально по ширине)
+def flip_image_vertical(img_arr):
+    return np.ascontiguousarray(img_arr[:, ::-1])
+
+
+# Операции над изображением по имени метода сервера: (результат, метаданные)
+def run_image_operation(img_arr, method, args):
+    if method == 'color_inversion':
+        return invert_image(img_arr), {}
+    if method in ('send_back_binarization', 'send_back_binarization_with_percent'):
+        threshold = args[0]
+        if not 1 <= threshold <= 255:
+            raise ValueError("Порог должен быть в диапазоне 1-255")
+        binarized_arr, cloud_percentage = binarize_image(img_arr, threshold)
+        return binarized_arr, {"percent": cloud_percentage}
+    if method == 'send_back_flip_vertical':
+        return flip_image_vertical(img_arr), {}
+    raise ValueError(f"Неизвестная операция над изображением: {method}")
+
+
+# Шаг конвейера: имя метода или [имя, аргументы...] -> (имя, аргументы)
+def parse_image_op(op):
+    if isinstance(op, str):
+        return op, []
+    return op[0], list(op[1:])
+
+
+# Конвейер шагов над одним массивом: (итоговое изображение, метаданные каждого шага)
+def run_pipeline(img_arr, ops):
+    ops_meta = []
+    for op in ops:
+        method, args = parse_image_op(op)
+        img_arr, meta = run_image_operation(img_arr, method, args)
+        ops_meta.append(dict(meta, op=method))
+    return img_arr, ops_meta
+
+
+# Ключ кэша результата: хэш содержимого изображения + шаги конвейера с аргументами
+def image_cache_key(img_arr, ops):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{img_arr.dtype.str}{img_arr.shape}{[parse_image_op(op) for op in ops]}".encode('utf-8'))
+    digest.update(memoryview(np.ascontiguousarray(img_arr)).cast('B'))
+    return digest.hexdigest()
+
+
+# Задача для процесса пула: изображение и место под результат лежат в разделяемой памяти,
+# через очередь пула передаются только имена сегментов и метаданные
+def shared_memory_task(in_name, out_name, dtype, shape, ops):
+    in_shm = shared_memory.SharedMemory(name=in_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    try:
+        img_arr = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=in_shm.buf)
+        result, ops_meta = run_pipeline(img_arr, ops)
+        out_arr = np.ndarray(result.shape, dtype=result.dtype, buffer=out_shm.buf)
+        out_arr[...] = result
+        result_info = (result.dtype.str, list(result.shape), ops_meta)
+        del img_arr, result, out_arr
+        return result_info
+    finally:
+        in_shm.close()
+        out_shm.close()
+
+
+# Запуск конвейера в пуле процессов. Операции не меняют размеры изображения,
+# а dtype результата не шире исходного, поэтому сегмент под результат того же размера
+def run_pipeline_in_pool(executor, img_arr, ops):
+    size = max(img_arr.nbytes, 1)
+    in_shm = shared_memory.SharedMemory(create=True, size=size)
+    out_shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        in_arr = np.ndarray(img_arr.shape, dtype=img_arr.dtype, buffer=in_shm.buf)
+        in_arr[...] = img_arr
+        del in_arr
+        dtype, shape, ops_meta = executor.submit(shared_memory_task, in_shm.name, out_shm.name,
+                                                 img_arr.dtype.str, list(img_arr.shape), ops).result()
+        result = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=out_shm.buf).copy()
+        return result, ops_meta
+    finally:
+        for shm in (in_shm, out_shm):
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,289 @@
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+# Колоночный архив журнала: для каждого закрытого дня каталог segments/YYYY-MM-DD с версиями
+# v<last_id> (файлы ниже) и файлом-указателем CURRENT с именем текущей версии:
+#   timestamp.bin      int64   - секунды от эпохи (время журнала без часового пояса)
+#   event_type.bin     uint16/uint32 - коды по словарю event_types из meta.json
+#   duration.bin       float32 - NaN, если длительности нет
+#   server_address.bin uint16/uint32 - коды по словарю server_addresses из meta.json
+# Строки отсортированы по времени. Файлы открываются через np.memmap, разбора строк при чтении нет.
+# Новая версия пишется рядом и публикуется атомарной заменой CURRENT; читатели ничего не переименовывают,
+# предыдущая версия остается до следующей выгрузки, чтобы успевшие прочитать CURRENT ее открыли
+SEGMENT_DIR = 'segments'
+SEGMENT_META = 'meta.json'
+SEGMENT_CURRENT = 'CURRENT'
+SEGMENT_COLUMNS = ('timestamp', 'event_type', 'duration', 'server_address')
+SEGMENT_TMP = '.tmp'
+
+# Границы интервала с точностью до дня, часа или минуты дополняются до секунд:
+# начало - к первой секунде, конец - к последней (как и в запросах к агрегатам)
+TIME_LOWER = '0000-01-01 00:00:00'
+TIME_UPPER = '9999-12-31 23:59:59'
+
+
+def pad_time_bound(value, upper=False):
+    return value + (TIME_UPPER if upper else TIME_LOWER)[len(value):]
+
+
+def segment_path(log_dir, day):
+    return os.path.join(log_dir, SEGMENT_DIR, day)
+
+
+# Имя текущей версии дня или None
+def current_version(path):
+    try:
+        with open(os.path.join(path, SEGMENT_CURRENT), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# Каталог с файлами текущей версии дня (сегменты без версий, с meta.json прямо в каталоге дня, тоже читаются)
+def resolve_segment(path):
+    version = current_version(path)
+    if version is not None:
+        return os.path.join(path, version)
+    if os.path.exists(os.path.join(path, SEGMENT_META)):
+        return path
+    return None
+
+
+# Дни с сегментами, пересекающиеся с [start, end]
+def list_segments(log_dir, start=False, end=False):
+    root = os.path.join(log_dir, SEGMENT_DIR)
+    if not os.path.isdir(root):
+        return []
+    days = [day for day in os.listdir(root)
+            if resolve_segment(os.path.join(root, day)) is not None
+            and not (start and day < start[:10]) and not (end and day > end[:10])]
+    return [(day, os.path.join(root, day)) for day in sorted(days)]
+
+
+# Открытие текущей версии дня; если писатель успел опубликовать новую и удалить прочитанную, читаем CURRENT заново
+def open_current_segment(path, attempts=3):
+    for attempt in range(attempts):
+        try:
+            return open_segment(resolve_segment(path))
+        except FileNotFoundError:
+            if attempt == attempts - 1:
+                raise
+
+
+def version_id(name):
+    return int(name[1:]) if name.startswith('v') and name[1:].isdigit() else None
+
+
+def code_dtype(size):
+    return np.uint16 if size <= np.iinfo(np.uint16).max else np.uint32
+
+
+# Время журнала ('YYYY-MM-DD HH:MM:SS') в секунды; строки в другом формате - начало их дня
+def parse_timestamps(timestamps):
+    try:
+        return np.array(timestamps, dtype='datetime64[s]').astype(np.int64)
+    except ValueError:
+        parsed = []
+        for timestamp in timestamps:
+            try:
+                parsed.append(np.datetime64(timestamp[:19], 's'))
+            except ValueError:
+                parsed.append(np.datetime64(timestamp[:10], 's'))
+        return np.array(parsed, dtype='datetime64[s]').astype(np.int64)
+
+
+# Открытие сегмента: {"meta": ..., "timestamp": memmap, ...}
+def open_segment(path):
+    with open(os.path.join(path, SEGMENT_META), encoding='utf-8') as f:
+        meta = json.load(f)
+    segment = {"meta": meta}
+    for column in SEGMENT_COLUMNS:
+        if meta["rows"] == 0:
+            segment[column] = np.empty(0, dtype=meta["dtypes"][column])
+        else:
+            segment[column] = np.memmap(os.path.join(path, f"{column}.bin"), dtype=meta["dtypes"][column],
+                                        mode='r', shape=(meta["rows"],))
+    return segment
+
+
+# Дописать в сегмент дня записи файла журнала с id больше уже выгруженных.
+# Сегмент переписывается целиком в новую версию v<last_id>, затем CURRENT атомарно указывает на нее.
+# Вызывается только писателем (сервер статистики): он же убирает следы прерванной выгрузки
+def export_partition(log_dir, day, partition_file):
+    path = segment_path(log_dir, day)
+    os.makedirs(path, exist_ok=True)
+    current = current_version(path)
+    cleanup_versions(path, keep=[current])
+    source = resolve_segment(path)
+    old = open_segment(source) if source else None
+    last_id = old["meta"]["last_id"] if old else 0
+
+    with sqlite3.connect(partition_file) as db:
+        rows = db.execute('SELECT id, event_type, timestamp, duration, server_address FROM logs '
+                          'WHERE id > ? ORDER BY id', (last_id,)).fetchall()
+    if not rows:
+        return 0
+
+    ids, event_types, timestamps, durations, addresses = zip(*rows)
+    event_dict = list(old["meta"]["event_types"]) if old else []
+    address_dict = list(old["meta"]["server_addresses"]) if old else []
+    event_index = {value: code for code, value in enumerate(event_dict)}
+    address_index = {value: code for code, value in enumerate(address_dict)}
+    new_events = [event_index.setdefault(value, len(event_index)) for value in event_types]
+    new_addresses = [address_index.setdefault(value or 'proxy', len(address_index)) for value in addresses]
+    event_dict = list(event_index)
+    address_dict = list(address_index)
+
+    columns = {
+        "timestamp": parse_timestamps(timestamps),
+        "event_type": np.array(new_events, dtype=code_dtype(len(event_dict))),
+        "duration": np.array([np.nan if d is None else d for d in durations], dtype=np.float32),
+        "server_address": np.array(new_addresses, dtype=code_dtype(len(address_dict)))
+    }
+    if old:
+        for column in SEGMENT_COLUMNS:
+            columns[column] = np.concatenate([np.asarray(old[column]).astype(columns[column].dtype),
+                                              columns[column]])
+    order = np.argsort(columns["timestamp"], kind='stable')
+
+    version = f"v{int(ids[-1])}"
+    version_path = os.path.join(path, version)
+    tmp_path = version_path + SEGMENT_TMP
+    os.makedirs(tmp_path)
+    for column in SEGMENT_COLUMNS:
+        columns[column][order].tofile(os.path.join(tmp_path, f"{column}.bin"))
+    meta = {
+        "day": day,
+        "rows": int(order.size),
+        "last_id": int(ids[-1]),
+        "dtypes": {column: columns[column].dtype.str for column in SEGMENT_COLUMNS},
+        "event_types": event_dict,
+        "server_addresses": address_dict
+    }
+    with open(os.path.join(tmp_path, SEGMENT_META), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    del old
+    os.replace(tmp_path, version_path)
+    pointer_tmp = os.path.join(path, SEGMENT_CURRENT + SEGMENT_TMP)
+    with open(pointer_tmp, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(path, SEGMENT_CURRENT))
+    # Остаются новая и предыдущая версии; файлы сегмента без версий больше не нужны
+    cleanup_versions(path, keep=[version, current])
+    if source == path:
+        for name in [f"{column}.bin" for column in SEGMENT_COLUMNS] + [SEGMENT_META]:
+            os.remove(os.path.join(path, name))
+    return len(rows)
+
+
+# Удаление версий дня, кроме keep, и недописанных временных файлов (только из писателя)
+def cleanup_versions(path, keep):
+    for name in os.listdir(path):
+        entry = os.path.join(path, name)
+        if name.endswith(SEGMENT_TMP):
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            else:
+                os.remove(entry)
+        elif version_id(name) is not None and name not in keep:
+            shutil.rmtree(entry)
+
+
+# Выгрузка всех закрытых дней (до сегодняшнего) из файлов журнала log_dir/log-YYYY-MM-DD.db
+def export_closed_partitions(log_dir, partitions, today=None):
+    today = (today or datetime.date.today()).isoformat()
+    exported = {}
+    for day, partition_file in partitions:
+        if day < today:
+            rows = export_partition(log_dir, day, partition_file)
+            if rows:
+                exported[day] = rows
+    return exported
+
+
+# Удаление сегментов за дни раньше keep_limit ('YYYY-MM-DD')
+def drop_segments(log_dir, keep_limit):
+    dropped = []
+    for day, path in list_segments(log_dir):
+        if day < keep_limit:
+            shutil.rmtree(path)
+            dropped.append(day)
+    return dropped
+
+
+# Колонки сегментов за [start, end] с фильтрами - по одному словарю массивов на сегмент.
+# Время отбирается бинарным поиском по отсортированному timestamp, остальные фильтры - маской по кодам
+def scan_segments(log_dir, start=False, end=False, event_type=None, server_address=None):
+    start_ts = np.datetime64(pad_time_bound(start), 's').astype(np.int64) if start else None
+    end_ts = np.datetime64(pad_time_bound(end, upper=True), 's').astype(np.int64) if end else None
+    for day, path in list_segments(log_dir, start, end):
+        segment = open_current_segment(path)
+        meta = segment["meta"]
+        lo = np.searchsorted(segment["timestamp"], start_ts, 'left') if start_ts is not None else 0
+        hi = np.searchsorted(segment["timestamp"], end_ts, 'right') if end_ts is not None else meta["rows"]
+        columns = {column: segment[column][lo:hi] for column in SEGMENT_COLUMNS}
+        mask = None
+        if event_type is not None:
+            if event_type not in meta["event_types"]:
+                continue
+            mask = columns["event_type"] == meta["event_types"].index(event_type)
+        if server_address is not None:
+            if server_address not in meta["server_addresses"]:
+                continue
+            address_mask = columns["server_address"] == meta["server_addresses"].index(server_address)
+            mask = address_mask if mask is None else mask & address_mask
+        if mask is not None:
+            columns = {column: values[mask] for column, values in columns.items()}
+        columns["event_types"] = meta["event_types"]
+        columns["server_addresses"] = meta["server_addresses"]
+        yield day, columns
+
+
+# Сводка по типам событий за интервал: count, число событий с длительностью, mean, max
+def segment_summary(log_dir, start=False, end=False, event_type=None, server_address=None):
+    summary = {}
+    for day, columns in scan_segments(log_dir, start, end, event_type, server_address):
+        names = columns["event_types"]
+        codes = columns["event_type"].astype(np.intp)
+        durations = columns["duration"].astype(np.float64)
+        has_duration = ~np.isnan(durations)
+        counts = np.bincount(codes, minlength=len(names))
+        duration_counts = np.bincount(codes[has_duration], minlength=len(names))
+        sums = np.bincount(codes[has_duration], weights=durations[has_duration], minlength=len(names))
+        maxima = np.full(len(names), -np.inf)
+        np.maximum.at(maxima, codes[has_duration], durations[has_duration])
+        for code, name in enumerate(names):
+            if not counts[code]:
+                continue
+            entry = summary.setdefault(name, {"count": 0, "duration_count": 0, "sum": 0.0, "max": None})
+            entry["count"] += int(counts[code])
+            entry["duration_count"] += int(duration_counts[code])
+            entry["sum"] += float(sums[code])
+            if duration_counts[code]:
+                entry["max"] = max(entry["max"] or float('-inf'), float(maxima[code]))
+    for entry in summary.values():
+        entry["mean"] = entry["sum"] / entry["duration_count"] if entry["duration_count"] else None
+    return summary
+
+
+# DataFrame (event_type, timestamp, duration, server_address) по сегментам для анализа в pandas.
+# Строковые колонки - категории прямо из кодов словаря
+def segments_frame(log_dir, start=False, end=False, event_type=None, server_address=None):
+    frames = []
+    for day, columns in scan_segments(log_dir, start, end, event_type, server_address):
+        frames.append(pd.DataFrame({
+            "event_type": pd.Categorical.from_codes(columns["event_type"].astype(np.int64), columns["event_types"]),
+            "timestamp": columns["timestamp"].astype('datetime64[s]'),
+            "duration": columns["duration"],
+            "server_address": pd.Categorical.from_codes(columns["server_address"].astype(np.int64),
+                                                        columns["server_addresses"])
+        }))
+    if not frames:
+        return pd.DataFrame(columns=["event_type", "timestamp", "duration", "server_address"])
+    return pd.concat(frames, ignore_index=True)
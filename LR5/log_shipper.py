@@ -0,0 +1,108 @@
+import datetime
+import queue
+import threading
+import time
+import xmlrpc.client
+
+STATS_SERVER_URL = "http://127.0.0.1:8018"
+
+
+# Фоновая отправка логов на сервер статистики пачками.
+# log() только кладет запись в ограниченную очередь и никогда не блокирует запрос:
+# при переполненной очереди запись отбрасывается и учитывается в dropped.
+# Пачка уходит, когда набралось batch_size записей или прошло flush_interval секунд
+class LogShipper:
+    def __init__(self, stats_url=STATS_SERVER_URL, max_queue=10000, batch_size=100, flush_interval=1.0):
+        self.stats_url = stats_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats_lock = threading.Lock()
+        self.shipped = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        # Старый сервер статистики без add_logs: шлем по одной записи
+        self.batch_supported = True
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Запись в очередь: (тип события, время, длительность, адрес)
+    def log(self, event_type, duration=None, server_address="proxy"):
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            self.queue.put_nowait([event_type, timestamp, duration, server_address])
+        except queue.Full:
+            with self.stats_lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def run(self):
+        # ServerProxy не потокобезопасен, поэтому свой экземпляр только у фонового потока
+        stats_server = xmlrpc.client.ServerProxy(self.stats_url, allow_none=True)
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            batch = self.collect()
+            if batch:
+                self.send(stats_server, batch)
+
+    # Набор пачки: до batch_size записей или до истечения flush_interval с первой записи
+    def collect(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or self.stop_event.is_set():
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def send(self, stats_server, batch):
+        try:
+            if self.batch_supported:
+                try:
+                    stats_server.add_logs(batch)
+                except xmlrpc.client.Fault as e:
+                    if 'is not supported' not in e.faultString:
+                        raise
+                    self.batch_supported = False
+            if not self.batch_supported:
+                for record in batch:
+                    stats_server.add_log(*record)
+        except (OSError, xmlrpc.client.ProtocolError, xmlrpc.client.Fault) as e:
+            # Сервер статистики недоступен: пачку не повторяем, чтобы не копить память
+            with self.stats_lock:
+                self.failed += len(batch)
+            print(f"Не удалось отправить логи ({len(batch)} записей): {e}")
+            return
+        with self.stats_lock:
+            self.shipped += len(batch)
+            self.batches += 1
+
+    # Счетчики для выдачи по RPC
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "queued": self.queue.qsize(),
+                "max_queue": self.queue.maxsize,
+                "shipped": self.shipped,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "failed": self.failed
+            }
+
+    # Остановка с отправкой того, что осталось в очереди
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        self.thread.join(timeout)
@@ -0,0 +1,552 @@
+import base64
+import datetime
+import glob
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from log_segments import drop_segments, export_closed_partitions, pad_time_bound
+
+# Режимы надежности записи:
+#   'off'    - synchronous=OFF, ответ сразу после постановки в буфер (быстро, при сбое ОС можно потерять хвост)
+#   'normal' - WAL + synchronous=NORMAL, ответ сразу после постановки в буфер (по умолчанию)
+#   'full'   - synchronous=FULL, ответ только после фиксации транзакции, в которую попала запись
+DURABILITY_MODES = {'off': 'OFF', 'normal': 'NORMAL', 'full': 'FULL'}
+
+# Режимы фильтра по типу события: подстрока (как раньше, без индекса), префикс и точное совпадение (по индексу)
+MATCH_MODES = ['contains', 'prefix', 'exact']
+MAX_PAGE_SIZE = 10000
+
+# Агрегаты по минутам и часам: ключ бакета - начало интервала в виде 'YYYY-MM-DD HH:MM'
+ROLLUP_TABLES = {'minute': 'rollup_minute', 'hour': 'rollup_hour'}
+
+
+def rollup_bucket(timestamp, granularity):
+    if granularity == 'minute':
+        return timestamp[:16]
+    return timestamp[:13] + ':00'
+
+
+# Журнал хранится по дням: logs/log-YYYY-MM-DD.db. Запись идет только в файл своего дня,
+# запросы открывают только файлы, пересекающиеся с запрошенным интервалом
+PARTITION_PREFIX = 'log-'
+PARTITION_SUFFIX = '.db'
+# Сколько соединений с файлами дней писатель держит открытыми (запоздавшие записи за прошлые дни)
+MAX_OPEN_PARTITIONS = 4
+
+
+def partition_path(log_dir, day):
+    return os.path.join(log_dir, f"{PARTITION_PREFIX}{day}{PARTITION_SUFFIX}")
+
+
+# День записи по ее времени; заодно проверка формата, так как из дня строится имя файла
+def partition_day(timestamp):
+    day = timestamp[:10]
+    datetime.datetime.strptime(day, '%Y-%m-%d')
+    return day
+
+
+# [(день, путь)] существующих файлов, пересекающихся с [start, end], по возрастанию дня
+def list_partitions(log_dir, start=False, end=False):
+    # Нестроковые границы (их SQLite сравнивает как раньше) дни не отсекают
+    start = start if isinstance(start, str) else False
+    end = end if isinstance(end, str) else False
+    partitions = []
+    for path in glob.glob(os.path.join(log_dir, f"{PARTITION_PREFIX}*{PARTITION_SUFFIX}")):
+        day = os.path.basename(path)[len(PARTITION_PREFIX):-len(PARTITION_SUFFIX)]
+        if (start and day < start[:10]) or (end and day > end[:10]):
+            continue
+        partitions.append((day, path))
+    return sorted(partitions)
+
+
+# Создаем БД если не существует; WAL сохраняется в файле и позволяет читать во время записи
+def init_db(db_file):
+    os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_file)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_type TEXT NOT NULL,
+            timestamp DATETIME NOT NULL,
+            duration REAL,
+            server_address TEXT DEFAULT 'proxy'
+        )
+    ''')
+    # Индексы под фильтры по времени, типу события и адресу; rowid (id) входит в каждый индекс,
+    # поэтому порядок (timestamp, id) для постраничной выдачи берется прямо из индекса
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_event_timestamp ON logs (event_type, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_logs_server_timestamp ON logs (server_address, timestamp)')
+    for granularity, table in ROLLUP_TABLES.items():
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL,
+                event_type TEXT NOT NULL,
+                server_address TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                duration_count INTEGER NOT NULL,
+                sum REAL NOT NULL,
+                min REAL,
+                max REAL,
+                sumsq REAL NOT NULL,
+                PRIMARY KEY (bucket, event_type, server_address)
+            ) WITHOUT ROWID
+        ''')
+    conn.commit()
+    conn.close()
+
+
+# Пересчет агрегатов по журналу файла (после переноса записей из старой базы)
+def rebuild_rollups(conn):
+    for granularity, table in ROLLUP_TABLES.items():
+        bucket = 'substr(timestamp, 1, 16)' if granularity == 'minute' else "substr(timestamp, 1, 13) || ':00'"
+        conn.execute(f'DELETE FROM {table}')
+        conn.execute(f'''
+            INSERT INTO {table}
+            SELECT {bucket}, event_type, coalesce(server_address, 'proxy'), count(*), count(duration),
+                   coalesce(sum(duration), 0), min(duration), max(duration), coalesce(sum(duration * duration), 0)
+            FROM logs GROUP BY 1, 2, 3
+        ''')
+
+
+# Перенос старой единой базы (logs/log.db) в файлы по дням. Старый файл открывается только на чтение
+# и не меняется (он лежит в репозитории), о переносе помнит метка LEGACY_MARKER в каталоге журнала.
+# Записи с временем не в формате 'YYYY-MM-DD ...' остаются только в старом файле
+LEGACY_MARKER = '.legacy-migrated'
+
+
+def migrate_legacy_db(legacy_file, log_dir):
+    marker = os.path.join(log_dir, LEGACY_MARKER)
+    if not os.path.exists(legacy_file) or os.path.exists(marker):
+        return 0
+    legacy_uri = f"file:{os.path.abspath(legacy_file)}?mode=ro"
+    conn = sqlite3.connect(legacy_uri, uri=True)
+    days = [row[0] for row in conn.execute(
+        "SELECT DISTINCT substr(timestamp, 1, 10) FROM logs "
+        "WHERE timestamp GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'")]
+    conn.close()
+    moved = 0
+    for day in days:
+        path = partition_path(log_dir, day)
+        init_db(path)
+        part = sqlite3.connect(path, uri=True)
+        part.execute('ATTACH DATABASE ? AS legacy', (legacy_uri,))
+        with part:
+            moved += part.execute('''
+                INSERT INTO logs (event_type, timestamp, duration, server_address)
+                SELECT event_type, timestamp, duration, server_address FROM legacy.logs
+                WHERE timestamp >= ? AND timestamp < ? ORDER BY id
+            ''', (day, day + '\uffff')).rowcount
+            rebuild_rollups(part)
+        part.execute('DETACH DATABASE legacy')
+        part.close()
+    with open(marker, 'w', encoding='utf-8') as f:
+        f.write(f"{legacy_file}: {moved}\n")
+    return moved
+
+
+# Политика хранения: закрытые дни сначала выгружаются в колоночные сегменты,
+# файлы старше raw_days дней сжимаются до агрегатов (сырые записи удаляются),
+# файлы и сегменты старше keep_days дней удаляются целиком
+def apply_retention(log_dir, raw_days, keep_days, today=None):
+    today = today or datetime.date.today()
+    raw_limit = (today - datetime.timedelta(days=raw_days)).isoformat()
+    keep_limit = (today - datetime.timedelta(days=keep_days)).isoformat()
+    result = {"compacted": [], "dropped": [],
+              "exported": export_closed_partitions(log_dir, list_partitions(log_dir, keep_limit), today)}
+    drop_segments(log_dir, keep_limit)
+    for day, path in list_partitions(log_dir):
+        if day < keep_limit:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            result["dropped"].append(day)
+        elif day < raw_limit:
+            conn = sqlite3.connect(path)
+            if conn.execute('SELECT 1 FROM logs LIMIT 1').fetchone() is not None:
+                with conn:
+                    conn.execute('DELETE FROM logs')
+                conn.execute('VACUUM')
+                result["compacted"].append(day)
+            conn.close()
+    return result
+
+
+# Обновление агрегатов пачкой записей (в той же транзакции, что и вставка в журнал)
+def update_rollups(conn, records):
+    for granularity, table in ROLLUP_TABLES.items():
+        groups = {}
+        for event_type, timestamp, duration, server_address in records:
+            key = (rollup_bucket(timestamp, granularity), event_type, server_address)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, 0, 0.0, None, None, 0.0]
+            group[0] += 1
+            if duration is not None:
+                group[1] += 1
+                group[2] += duration
+                group[3] = duration if group[3] is None else min(group[3], duration)
+                group[4] = duration if group[4] is None else max(group[4], duration)
+                group[5] += duration * duration
+        conn.executemany(f'''
+            INSERT INTO {table} (bucket, event_type, server_address, count, duration_count, sum, min, max, sumsq)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (bucket, event_type, server_address) DO UPDATE SET
+                count = count + excluded.count,
+                duration_count = duration_count + excluded.duration_count,
+                sum = sum + excluded.sum,
+                min = min(coalesce(min, excluded.min), coalesce(excluded.min, min)),
+                max = max(coalesce(max, excluded.max), coalesce(excluded.max, max)),
+                sumsq = sumsq + excluded.sumsq
+        ''', [key + tuple(group) for key, group in groups.items()])
+
+
+# Запись журнала (тип события, время, длительность, адрес) с проверкой формата
+def normalize_record(record):
+    if not 2 <= len(record) <= 4:
+        raise ValueError(f"Ожидается [event_type, timestamp, duration, server_address], получено {record!r}")
+    event_type, timestamp, duration, server_address = (list(record) + [None, None])[:4]
+    try:
+        partition_day(str(timestamp))
+    except ValueError:
+        raise ValueError(f"Время записи должно быть в формате 'YYYY-MM-DD HH:MM:SS', получено {timestamp!r}")
+    return (str(event_type), str(timestamp), None if duration is None else float(duration),
+            server_address or "proxy")
+
+
+# Групповая фиксация: отдельный поток с долгоживущими соединениями пишет накопленные записи
+# одной транзакцией на файл дня, когда их набралось batch_size или прошло flush_ms миллисекунд.
+# Тот же поток раз в retention_interval секунд применяет политику хранения (raw_days / keep_days)
+class LogWriter:
+    def __init__(self, log_dir, batch_size=500, flush_ms=50, durability='normal',
+                 raw_days=7, keep_days=90, retention_interval=3600):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Неизвестный режим надежности: {durability}")
+        self.log_dir = log_dir
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.durability = durability
+        self.raw_days = raw_days
+        self.keep_days = keep_days
+        self.retention_interval = retention_interval
+        self.retention_requested = threading.Event()
+        self.last_retention = None
+        self.connections = OrderedDict()
+        self.applied_durability = None
+        self.queue = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.written = 0
+        self.commits = 0
+        self.errors = 0
+        self.expired = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Постановка записей в буфер; в режиме 'full' ждем фиксации
+    def add(self, records):
+        records = [normalize_record(r) for r in records]
+        if not records:
+            return 0
+        waiter = {"done": threading.Event(), "error": None} if self.durability == 'full' else None
+        self.queue.put((records, waiter))
+        if waiter is not None:
+            waiter["done"].wait()
+            if waiter["error"] is not None:
+                raise sqlite3.OperationalError(waiter["error"])
+        return len(records)
+
+    def set_durability(self, durability):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Неизвестный режим надежности: {durability}")
+        self.durability = durability
+        return True
+
+    # Дождаться записи всего, что уже поставлено в буфер
+    def flush(self):
+        waiter = {"done": threading.Event(), "error": None}
+        self.queue.put(([], waiter))
+        waiter["done"].wait()
+        return waiter["error"] is None
+
+    # Внеочередное применение политики хранения (выполняется в потоке записи)
+    def run_retention(self):
+        self.retention_requested.set()
+        self.flush()
+        return self.last_retention
+
+    # Соединение с файлом дня; давно не использованные соединения закрываются
+    def get_connection(self, day):
+        conn = self.connections.get(day)
+        if conn is None:
+            path = partition_path(self.log_dir, day)
+            init_db(path)
+            conn = sqlite3.connect(path)
+            conn.execute(f'PRAGMA synchronous={DURABILITY_MODES[self.applied_durability]}')
+            self.connections[day] = conn
+            while len(self.connections) > MAX_OPEN_PARTITIONS:
+                self.connections.popitem(last=False)[1].close()
+        self.connections.move_to_end(day)
+        return conn
+
+    def write(self, records):
+        if self.applied_durability != self.durability:
+            self.applied_durability = self.durability
+            for conn in self.connections.values():
+                conn.execute(f'PRAGMA synchronous={DURABILITY_MODES[self.applied_durability]}')
+        keep_limit = (datetime.date.today() - datetime.timedelta(days=self.keep_days)).isoformat()
+        by_day = {}
+        for record in records:
+            by_day.setdefault(partition_day(record[1]), []).append(record)
+        for day, day_records in by_day.items():
+            # Записи за дни, которые уже вышли за срок хранения, не пишем
+            if day < keep_limit:
+                with self.stats_lock:
+                    self.expired += len(day_records)
+                continue
+            conn = self.get_connection(day)
+            with conn:
+                conn.executemany('''
+                    INSERT INTO logs (event_type, timestamp, duration, server_address)
+                    VALUES (?, ?, ?, ?)
+                ''', day_records)
+                update_rollups(conn, day_records)
+            with self.stats_lock:
+                self.written += len(day_records)
+                self.commits += 1
+
+    def retention(self):
+        for conn in self.connections.values():
+            conn.close()
+        self.connections.clear()
+        self.last_retention = apply_retention(self.log_dir, self.raw_days, self.keep_days)
+        self.last_retention["at"] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if self.last_retention["compacted"] or self.last_retention["dropped"] or self.last_retention["exported"]:
+            print('Retention: ', self.last_retention)
+
+    def run(self):
+        next_retention = time.monotonic()
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            items = self.collect()
+            error = None
+            try:
+                if items:
+                    self.write([record for batch, _ in items for record in batch])
+                if self.retention_requested.is_set() or time.monotonic() >= next_retention:
+                    self.retention_requested.clear()
+                    next_retention = time.monotonic() + self.retention_interval
+                    self.retention()
+            except (sqlite3.Error, OSError, ValueError) as e:
+                error = str(e)
+                with self.stats_lock:
+                    self.errors += 1
+                print('DB error: ', e)
+            for _, waiter in items:
+                if waiter is not None:
+                    waiter["error"] = error
+                    waiter["done"].set()
+        for conn in self.connections.values():
+            conn.close()
+
+    # Набор группы: до batch_size записей или до истечения flush_ms с первой из них
+    def collect(self):
+        try:
+            items = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        count = len(items[0][0])
+        deadline = time.monotonic() + self.flush_ms / 1000
+        while count < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            items.append(item)
+            count += len(item[0])
+        return items
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "pending": self.queue.qsize(),
+                "written": self.written,
+                "commits": self.commits,
+                "errors": self.errors,
+                "expired": self.expired,
+                "open_partitions": list(self.connections),
+                "last_retention": self.last_retention,
+                "batch_size": self.batch_size,
+                "flush_ms": self.flush_ms,
+                "durability": self.durability
+            }
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+
+# Условие WHERE и параметры по фильтрам журнала
+def build_log_filters(event_filter=False, start_time=False, end_time=False, min_duration=False,
+                      max_duration=False, match_mode='contains', server_address=False):
+    if match_mode not in MATCH_MODES:
+        raise ValueError(f"Неизвестный режим фильтра: {match_mode}")
+    query = ' WHERE 1=1'
+    params = []
+
+    if event_filter and match_mode == 'exact':
+        query += ' AND event_type = ?'
+        params.append(event_filter)
+    elif event_filter and match_mode == 'prefix':
+        # Диапазон [prefix, prefix со следующим последним символом) вместо LIKE, чтобы работал индекс
+        query += ' AND event_type >= ? AND event_type < ?'
+        params += [event_filter, event_filter[:-1] + chr(ord(event_filter[-1]) + 1)]
+    elif event_filter:
+        query += ' AND event_type LIKE ?'
+        params.append(f'%{event_filter}%')
+
+    if server_address:
+        query += ' AND server_address = ?'
+        params.append(server_address)
+
+    if start_time:
+        query += ' AND timestamp >= ?'
+        params.append(start_time)
+
+    if end_time:
+        query += ' AND timestamp <= ?'
+        params.append(end_time)
+
+    if min_duration:
+        query += ' AND duration >= ?'
+        params.append(min_duration)
+
+    if max_duration:
+        query += ' AND duration <= ?'
+        params.append(max_duration)
+
+    return query, params
+
+
+# Курсор страницы - непрозрачная строка с (timestamp, id) последней выданной записи
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f"{timestamp}|{row_id}".encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return timestamp, int(row_id)
+    except (ValueError, UnicodeError):
+        raise ValueError("Некорректный курсор страницы")
+
+
+# Записи журнала по фильтрам из всех файлов дней, пересекающихся с [start_time, end_time]
+def query_log(log_dir, event_filter=False, start_time=False, end_time=False, min_duration=False,
+              max_duration=False, logs_limit=False, match_mode='contains'):
+    where, params = build_log_filters(event_filter, start_time, end_time, min_duration, max_duration, match_mode)
+    rows = []
+    for day, path in list_partitions(log_dir, start_time, end_time):
+        query = 'SELECT event_type, timestamp, duration FROM logs' + where
+        day_params = list(params)
+        if logs_limit:
+            query += ' LIMIT ?'
+            day_params.append(logs_limit - len(rows))
+        with sqlite3.connect(path) as db:
+            rows += db.execute(query, day_params).fetchall()
+        if logs_limit and len(rows) >= logs_limit:
+            break
+    return rows
+
+
+# Страница журнала по ключу (timestamp, id): стоимость не зависит от номера страницы.
+# Дни упорядочены так же, как timestamp, поэтому страница продолжается с файла дня курсора.
+# Возвращает {"rows": [[event_type, timestamp, duration, server_address], ...], "next_cursor": ... или None}
+def query_log_page(log_dir, filters, cursor=None, page_size=1000):
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    where, params = build_log_filters(**filters)
+    start = filters.get('start_time', False)
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and (not start or after[0] > start):
+        start = after[0]
+    rows = []
+    for day, path in list_partitions(log_dir, start, filters.get('end_time', False)):
+        query = 'SELECT id, event_type, timestamp, duration, server_address FROM logs' + where
+        day_params = list(params)
+        if after is not None and after[0][:10] == day:
+            query += ' AND (timestamp, id) > (?, ?)'
+            day_params += list(after)
+        with sqlite3.connect(path) as db:
+            rows += db.execute(query + ' ORDER BY timestamp, id LIMIT ?',
+                               day_params + [page_size + 1 - len(rows)]).fetchall()
+        if len(rows) > page_size:
+            break
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+    return {"rows": [list(row[1:]) for row in rows], "next_cursor": next_cursor}
+
+
+# Клиентская сторона: построчный обход журнала, страницы запрашиваются по мере чтения
+def iter_log(stats_server, page_size=1000, **filters):
+    cursor = None
+    while True:
+        page = stats_server.get_log_page(filters, cursor, page_size)
+        yield from page["rows"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return
+
+
+# Агрегаты за интервал [start, end] по бакетам granularity ('minute' или 'hour'), бакет не пересекает границу дня.
+# filters: event_type (с match_mode 'exact' или 'prefix'), server_address.
+# Стоимость пропорциональна числу бакетов, а не числу событий
+def query_stats(log_dir, granularity='minute', start=False, end=False, filters=None):
+    if granularity not in ROLLUP_TABLES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+    filters = filters or {}
+    query = f'SELECT * FROM {ROLLUP_TABLES[granularity]} WHERE 1=1'
+    params = []
+    # Границы можно задавать с точностью до дня или минуты: недостающая часть дополняется
+    if start:
+        query += ' AND bucket >= ?'
+        params.append(rollup_bucket(pad_time_bound(start), granularity))
+    if end:
+        query += ' AND bucket <= ?'
+        params.append(rollup_bucket(pad_time_bound(end, upper=True), granularity))
+    event_type = filters.get('event_type')
+    if event_type and filters.get('match_mode', 'exact') == 'prefix':
+        query += ' AND event_type >= ? AND event_type < ?'
+        params += [event_type, event_type[:-1] + chr(ord(event_type[-1]) + 1)]
+    elif event_type:
+        query += ' AND event_type = ?'
+        params.append(event_type)
+    if filters.get('server_address'):
+        query += ' AND server_address = ?'
+        params.append(filters['server_address'])
+    query += ' ORDER BY bucket, event_type, server_address'
+
+    rows = []
+    for day, path in list_partitions(log_dir, start, end):
+        with sqlite3.connect(path) as db:
+            rows += db.execute(query, params).fetchall()
+
+    result = []
+    for bucket, event_type, server_address, count, duration_count, total, low, high, sumsq in rows:
+        mean = total / duration_count if duration_count else None
+        result.append({
+            "bucket": bucket, "event_type": event_type, "server_address": server_address,
+            "count": count, "duration_count": duration_count, "sum": total, "min": low, "max": high,
+            "sumsq": sumsq, "mean": mean,
+            "stddev": math.sqrt(max(sumsq / duration_count - mean * mean, 0.0)) if duration_count else None
+        })
+    return result
@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# LRU-кэш, ограниченный суммарным размером значений в байтах (размер передается при записи).
+# Необязательный ttl задает время жизни записи в секундах
+class ByteLRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size, ttl=None):
+        if size > self.max_bytes:
+            return False
+        expires = time.time() + ttl if ttl else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            while self.entries and self.total_bytes + size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+            self.entries[key] = (value, size, expires)
+            self.total_bytes += size
+        return True
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+        return True
+
+    # Счетчики для выдачи по RPC
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes
+            }
@@ -0,0 +1,109 @@
+import select
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+# Заголовок, которым пул соединений прокси просит держать соединение открытым
+POOLED_CONNECTION_HEADER = 'X-Pooled-Connection'
+
+
+# XML-RPC сервер с ограниченным пулом потоков:
+# не больше max_in_flight запросов выполняются одновременно, не больше max_queue ждут в очереди,
+# остальным сразу отвечаем 503, чтобы клиент (прокси) мог уйти на другой воркер.
+# При keep-alive (HTTP/1.1) поток занят соединением, поэтому соединения и запросы считаются отдельно:
+# connections - открытые соединения, in_flight - выполняющиеся сейчас вызовы
+class PooledXMLRPCServer(SimpleXMLRPCServer):
+    def __init__(self, addr, max_in_flight=8, max_queue=32, **kwargs):
+        # Очередь listen() не меньше допустимого числа соединений, иначе лишние SYN ждут повтора ~1 с
+        self.request_queue_size = max(self.request_queue_size, max_in_flight + max_queue)
+        super().__init__(addr, **kwargs)
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='xmlrpc')
+        self.slots = threading.BoundedSemaphore(max_in_flight + max_queue)
+        self.load_lock = threading.Lock()
+        self.in_flight = 0
+        self.connections = 0
+        self.queued = 0
+        self.rejected = 0
+
+    # Текущая загрузка сервера
+    def get_load(self):
+        with self.load_lock:
+            return {
+                "in_flight": self.in_flight,
+                "connections": self.connections,
+                "queued": self.queued,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "rejected": self.rejected
+            }
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            with self.load_lock:
+                self.rejected += 1
+            try:
+                request.sendall(b"HTTP/1.0 503 Service Unavailable\r\n"
+                                b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        with self.load_lock:
+            self.queued += 1
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        with self.load_lock:
+            self.queued -= 1
+            self.connections += 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.load_lock:
+                self.connections -= 1
+            self.slots.release()
+
+    # Один XML-RPC вызов (на одном соединении их может быть несколько)
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        with self.load_lock:
+            self.in_flight += 1
+        try:
+            return super()._marshaled_dispatch(data, dispatch_method, path)
+        finally:
+            with self.load_lock:
+                self.in_flight -= 1
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+
+# Обработчик с keep-alive (HTTP/1.1) только для соединений из пула прокси (заголовок POOLED_CONNECTION_HEADER)
+# и только на PooledXMLRPCServer: остальным клиентам отвечаем по HTTP/1.0 и закрываем соединение.
+# Простаивающее соединение закрывается через idle_timeout секунд, чтобы не держать поток пула
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = 10
+    idle_timeout = 0.5
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        if self.headers.get(POOLED_CONNECTION_HEADER) != '1' or not isinstance(self.server, PooledXMLRPCServer):
+            self.protocol_version = 'HTTP/1.0'
+            self.close_connection = True
+        return True
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            readable, _, _ = select.select([self.connection], [], [], self.idle_timeout)
+            if not readable:
+                break
+            self.handle_one_request()
@@ -0,0 +1,84 @@
+import threading
+import time
+
+
+# Token bucket на каждую пару (клиент, класс методов): емкость n, пополнение n/t токенов в секунду.
+# Проверка - O(1) под короткой блокировкой, ожидания нет: без токена запрос сразу получает отказ
+# с подсказкой, через сколько секунд токен появится
+class RateLimiter:
+    def __init__(self, n=5, t=5, prune_interval=60):
+        self.limits = {None: (n, t)}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.prune_interval = prune_interval
+        self.last_prune = time.monotonic()
+        self.allowed = 0
+        self.rejected = 0
+
+    # Лимит: сначала для клиента и класса, потом для класса, потом общий
+    def get_limit(self, client, method_class):
+        for key in ((client, method_class), (client, None), method_class):
+            if key in self.limits:
+                return self.limits[key]
+        return self.limits[None]
+
+    # n запросов за t секунд; client / method_class - None, если лимит общий.
+    # Без client и method_class меняется общий лимит и сбрасываются уточнения, как раньше
+    def set_limit(self, n, t, method_class=None, client=None):
+        if n < 1 or t <= 0:
+            raise ValueError("n >= 1 и t > 0")
+        with self.lock:
+            if client is not None:
+                key = (client, method_class)
+            else:
+                key = method_class
+            if key is None:
+                self.limits = {None: (n, t)}
+                self.buckets.clear()
+            else:
+                self.limits[key] = (n, t)
+                for bucket_key in list(self.buckets):
+                    if client in (None, bucket_key[0]) and method_class in (None, bucket_key[1]):
+                        del self.buckets[bucket_key]
+        return True
+
+    # (True, 0) - запрос пропущен; (False, retry_after) - отказ, токен появится через retry_after секунд
+    def acquire(self, client, method_class):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_prune > self.prune_interval:
+                self.prune(now)
+            n, t = self.get_limit(client, method_class)
+            rate = n / t
+            bucket = self.buckets.get((client, method_class))
+            if bucket is None:
+                bucket = self.buckets[(client, method_class)] = [float(n), now]
+            tokens = min(float(n), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                self.allowed += 1
+                return True, 0.0
+            bucket[0] = tokens
+            self.rejected += 1
+            return False, (1 - tokens) / rate
+
+    # Удаление давно неактивных (уже полных) ведер, чтобы не копить память по старым клиентам
+    def prune(self, now):
+        self.last_prune = now
+        for key, (tokens, last) in list(self.buckets.items()):
+            n, t = self.get_limit(*key)
+            if tokens + (now - last) * n / t >= n:
+                del self.buckets[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "limits": [{"client": key[0] if isinstance(key, tuple) else None,
+                            "method_class": key[1] if isinstance(key, tuple) else key,
+                            "n": n, "t": t}
+                           for key, (n, t) in self.limits.items()],
+                "buckets": len(self.buckets),
+                "allowed": self.allowed,
+                "rejected": self.rejected
+            }
@@ -0,0 +1,48 @@
+import pytest
+
+from blacklist import check_batch, search
+
+CSV = ("Surname,Name,Patronym,Birth,City,Position\n"
+       "Иванов,Иван,Иванович,22.03.1989,Москва,\n"
+       "Петров,Петр,Петрович,01.01.1990,Рязань,\n")
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / 'bad_boys.csv'
+    path.write_text(CSV, encoding='utf-8')
+    return str(path)
+
+
+# Некорректная запись - ошибка только этой записи, остальные проверяются
+@pytest.mark.parametrize('record', [5, None, "abcd", ["Иванов", "Иван", "Иванович"], ["a", "b", "c", 1],
+                                    {"surname": "Иванов"}])
+def test_check_batch_malformed_record(csv_file, record):
+    results = check_batch([record, ["Иванов", "Иван", "Иванович", "22.03.1989"]], csv_file)
+    assert results[0]["status"] == "error"
+    assert results[1]["status"] == "exact"
+
+
+def test_check_batch_statuses(csv_file):
+    results = check_batch([["петров", "петр", "петрович", "01.01.1990"],
+                           ["Иванов", "Иван", "Иванавич", "22.03.1989"],
+                           ["Сидоров", "Иван", "Иванович", "22.03.1989"],
+                           ["Иванов", "Иван", "Иванович", "32.13.1989"]], csv_file)
+    assert [result["status"] for result in results] == ["exact", "similar", "clear", "error"]
+    assert results[1]["matches"][0]["patronym"] == "Иванович"
+
+
+def test_search_by_birth_date(csv_file):
+    results = search(["Иванов", "Иван", "Иванавич", "22.03.1989"], csv_file=csv_file)
+    assert [(result["surname"], result["score"]) for result in results] == [("Иванов", 1)]
+    assert search(["Иванов", "Иван", "Иванович", "02.02.1991"], csv_file=csv_file) == []
+
+
+# При равном score в top-k попадает строка, которая раньше в файле, независимо от порядка обхода BK-дерева
+def test_search_ties_resolved_by_position(tmp_path):
+    path = tmp_path / 'bad_boys.csv'
+    path.write_text("Surname,Name,Patronym,Birth,City,Position\n"
+                    "Иванова,Иван,Иванович,22.03.1989,Москва,\n"
+                    "Иванов,Ивак,Иванович,01.01.1990,Рязань,\n", encoding='utf-8')
+    results = search(["Иванов", "Иван", "Иванович"], k=1, csv_file=str(path))
+    assert [(result["surname"], result["score"]) for result in results] == [("Иванова", 1)]
@@ -0,0 +1,265 @@
+import lzma
+import pickle
+import struct
+import threading
+import time
+import xmlrpc.client
+import zlib
+
+import numpy as np
+
+# Формат передачи ndarray без pickle:
+# фиксированный заголовок 128 байт (magic, dtype, ndim, shape, strides) + сырой буфер массива
+NDARRAY_MAGIC = b'NDA1'
+NDARRAY_MAX_DIMS = 6
+NDARRAY_HEADER = struct.Struct('<4s16sB6q6q11x')
+
+WIRE_NDARRAY = 'ndarray'
+WIRE_PICKLE = 'pickle'
+WIRE_FORMATS = [WIRE_NDARRAY, WIRE_PICKLE]
+
+
+# Сжатие полезной нагрузки (stdlib): конверт 'CMP1' + запрошенный кодек + примененный кодек + исходный размер.
+# Запрошенный кодек говорит, чем сжимать ответ; мелкие или несжимаемые данные идут с кодеком 'none'
+COMPRESSION_MAGIC = b'CMP1'
+COMPRESSION_HEADER = struct.Struct('<4sBB2xQ')
+COMPRESSION_THRESHOLD = 64 * 1024
+CODEC_NONE = 'none'
+CODEC_IDS = {CODEC_NONE: 0, 'zlib': 1, 'lzma': 2}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+COMPRESSION_CODECS = ['zlib', 'lzma']
+# Предел размера распакованных данных независимо от заголовка
+MAX_PAYLOAD_BYTES = 512 * 1024 * 1024
+
+
+def check_codec(codec):
+    if codec not in CODEC_IDS:
+        raise ValueError(f"Неизвестный кодек сжатия: {codec}. Доступны: {', '.join(COMPRESSION_CODECS)}")
+
+
+def compress_bytes(data, codec):
+    check_codec(codec)
+    if codec == 'zlib':
+        return zlib.compress(data, 1)
+    return lzma.compress(data, preset=0)
+
+
+# Распаковка с ограничением на заявленный размер (защита от "zip-бомб").
+# Размер проверяется до распаковки: 0 у zlib означал бы распаковку без ограничения
+def decompress_bytes(data, codec, raw_size, max_size=MAX_PAYLOAD_BYTES):
+    if raw_size <= 0 or raw_size > max_size:
+        raise ValueError(f"Недопустимый размер распакованных данных: {raw_size}")
+    if codec == 'zlib':
+        decompressor = zlib.decompressobj()
+        raw = decompressor.decompress(data, raw_size)
+    else:
+        decompressor = lzma.LZMADecompressor()
+        raw = decompressor.decompress(data, max_length=raw_size)
+    if len(raw) != raw_size or not decompressor.eof:
+        raise ValueError("Размер распакованных данных не совпадает с заголовком")
+    return raw
+
+
+# Статистика сжатия по кодекам: объем до/после и время работы кодека
+class CompressionStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.codecs = {}
+
+    def _entry(self, codec):
+        return self.codecs.setdefault(codec, {
+            "compress_calls": 0, "decompress_calls": 0, "skipped": 0, "raw_bytes": 0, "wire_bytes": 0,
+            "compress_seconds": 0.0, "decompress_seconds": 0.0
+        })
+
+    def record(self, codec, direction, raw_bytes, wire_bytes, seconds):
+        with self.lock:
+            entry = self._entry(codec)
+            entry[f"{direction}_calls"] += 1
+            entry[f"{direction}_seconds"] += seconds
+            entry["raw_bytes"] += raw_bytes
+            entry["wire_bytes"] += wire_bytes
+
+    # Сжатие пропущено: мало данных или выигрыша нет
+    def record_skip(self, codec):
+        with self.lock:
+            self._entry(codec)["skipped"] += 1
+
+    # Снимок для выдачи по RPC (ratio - во сколько раз сжалось)
+    def snapshot(self):
+        with self.lock:
+            return {codec: dict(entry, ratio=entry["raw_bytes"] / entry["wire_bytes"] if entry["wire_bytes"] else 0.0)
+                    for codec, entry in self.codecs.items()}
+
+
+compression_stats = CompressionStats()
+
+
+# Конверт сжатия; данные меньше threshold и несжимаемые данные не сжимаются
+def wrap_payload(data, codec, threshold=COMPRESSION_THRESHOLD):
+    check_codec(codec)
+    applied = CODEC_NONE
+    body = data
+    if codec != CODEC_NONE and len(data) >= threshold:
+        start = time.perf_counter()
+        compressed = compress_bytes(data, codec)
+        seconds = time.perf_counter() - start
+        if len(compressed) < len(data):
+            applied, body = codec, compressed
+            compression_stats.record(codec, "compress", len(data), len(body), seconds)
+        else:
+            compression_stats.record_skip(codec)
+    elif codec != CODEC_NONE:
+        compression_stats.record_skip(codec)
+    header = COMPRESSION_HEADER.pack(COMPRESSION_MAGIC, CODEC_IDS[codec], CODEC_IDS[applied], len(data))
+    return b''.join((header, body))
+
+
+# Снятие конверта: (исходные данные, кодек, которым просили сжимать ответ или None без конверта)
+def unwrap_payload(data, max_size=MAX_PAYLOAD_BYTES):
+    if bytes(data[:len(COMPRESSION_MAGIC)]) != COMPRESSION_MAGIC:
+        return data, None
+    if len(data) < COMPRESSION_HEADER.size:
+        raise ValueError("Слишком короткий заголовок сжатия")
+    _, requested_id, applied_id, raw_size = COMPRESSION_HEADER.unpack_from(data)
+    if requested_id not in CODEC_NAMES or applied_id not in CODEC_NAMES:
+        raise ValueError("Неизвестный кодек сжатия в заголовке")
+    requested, applied = CODEC_NAMES[requested_id], CODEC_NAMES[applied_id]
+    body = memoryview(data)[COMPRESSION_HEADER.size:]
+    if applied == CODEC_NONE:
+        if raw_size != len(body):
+            raise ValueError("Размер данных не совпадает с заголовком")
+        return body, requested
+    start = time.perf_counter()
+    raw = decompress_bytes(body, applied, raw_size, max_size)
+    compression_stats.record(applied, "decompress", raw_size, len(body), time.perf_counter() - start)
+    return raw, requested
+
+
+# Формат передачи вида 'ndarray' или 'ndarray+zlib' -> (формат, кодек или None)
+def split_wire_format(wire_format):
+    payload_format, _, codec = wire_format.partition('+')
+    return payload_format, codec or None
+
+
+# Полезная нагрузка в формате ndarray?
+def is_ndarray_payload(data):
+    return bytes(data[:len(NDARRAY_MAGIC)]) == NDARRAY_MAGIC
+
+
+# Упаковка массива: заголовок + память массива (без промежуточного pickle)
+def encode_ndarray(img_arr):
+    img_arr = np.asarray(img_arr)
+    if img_arr.dtype.hasobject or img_arr.dtype.fields is not None:
+        raise ValueError(f"Тип {img_arr.dtype} нельзя передать в формате ndarray")
+    if img_arr.ndim > NDARRAY_MAX_DIMS:
+        raise ValueError(f"Размерность массива больше {NDARRAY_MAX_DIMS}")
+    if not (img_arr.flags.c_contiguous or img_arr.flags.f_contiguous):
+        img_arr = np.ascontiguousarray(img_arr)
+
+    dims = NDARRAY_MAX_DIMS - img_arr.ndim
+    header = NDARRAY_HEADER.pack(NDARRAY_MAGIC, img_arr.dtype.str.encode('ascii'), img_arr.ndim,
+                                 *(img_arr.shape + (0,) * dims), *(img_arr.strides + (0,) * dims))
+    # ravel(order='K') для C/F-непрерывного массива - представление, а не копия
+    return b''.join((header, memoryview(img_arr.ravel(order='K')).cast('B')))
+
+
+# Распаковка без копирования: массив только для чтения поверх полученного буфера
+def decode_ndarray(data):
+    if len(data) < NDARRAY_HEADER.size:
+        raise ValueError("Слишком короткий заголовок ndarray")
+    magic, dtype_str, ndim, *dims = NDARRAY_HEADER.unpack_from(data)
+    if magic != NDARRAY_MAGIC:
+        raise ValueError("Неизвестный формат данных")
+    if ndim > NDARRAY_MAX_DIMS:
+        raise ValueError(f"Размерность массива больше {NDARRAY_MAX_DIMS}")
+
+    dtype = np.dtype(dtype_str.rstrip(b'\0').decode('ascii'))
+    if dtype.hasobject:
+        raise ValueError("Объектные массивы не принимаются")
+    shape = tuple(dims[:ndim])
+    strides = tuple(dims[NDARRAY_MAX_DIMS:NDARRAY_MAX_DIMS + ndim])
+    if any(s < 0 for s in shape + strides):
+        raise ValueError("Отрицательные размеры или шаги не поддерживаются")
+    # np.ndarray сам проверяет, что shape/strides не выходят за границы буфера
+    return np.ndarray(shape, dtype=dtype, buffer=data, offset=NDARRAY_HEADER.size, strides=strides)
+
+
+# Упаковка изображения в Binary в согласованном формате ('ndarray', 'pickle', 'ndarray+zlib', ...)
+def pack_image(img_arr, wire_format=WIRE_NDARRAY, threshold=COMPRESSION_THRESHOLD):
+    payload_format, codec = split_wire_format(wire_format)
+    if payload_format == WIRE_NDARRAY:
+        data = encode_ndarray(img_arr)
+    else:
+        data = pickle.dumps(img_arr)
+    if codec is not None:
+        data = wrap_payload(data, codec, threshold)
+    return xmlrpc.client.Binary(data)
+
+
+# Распаковка Binary: сжатие и формат определяются по magic, иначе pickle.
+# Второй элемент - формат для ответа в том же виде, в котором пришел запрос
+def unpack_image(bin_data, allow_pickle=True):
+    data, codec = unwrap_payload(bin_data.data)
+    if is_ndarray_payload(data):
+        img_arr, payload_format = decode_ndarray(data), WIRE_NDARRAY
+    elif not allow_pickle:
+        raise ValueError("Формат pickle отключен на сервере")
+    else:
+        img_arr, payload_format = pickle.loads(data), WIRE_PICKLE
+    return img_arr, payload_format if codec is None else f"{payload_format}+{codec}"
+
+
+# Выбор формата: ndarray, если сервер его поддерживает, иначе pickle (старые серверы).
+# compression - желаемый кодек ('zlib'/'lzma'), добавляется, только если сервер его знает.
+# Старым сервером считается только ответ "method ... is not supported"; прочие ошибки
+# (например, 429 от лимита запросов прокси) пробрасываются, чтобы не перейти на pickle молча
+def is_unsupported_method(fault):
+    return 'is not supported' in fault.faultString
+
+
+def negotiate_wire_format(server, compression=None):
+    try:
+        formats = server.wire_formats()
+    except xmlrpc.client.Fault as e:
+        if not is_unsupported_method(e):
+            raise
+        return WIRE_PICKLE
+    wire_format = WIRE_NDARRAY if WIRE_NDARRAY in formats else WIRE_PICKLE
+    if compression is not None:
+        try:
+            if compression in server.compression_codecs():
+                wire_format = f"{wire_format}+{compression}"
+        except xmlrpc.client.Fault as e:
+            if not is_unsupported_method(e):
+                raise
+    return wire_format
+
+
+# Размер части при сессионной передаче больших изображений
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+# Обработка большого изображения частями: загрузка, обработка на сервере, выгрузка результата
+# compression - кодек для частей в обе стороны (None - без сжатия)
+def process_chunked(server, img_arr, method, *args, chunk_size=CHUNK_SIZE, compression=None):
+    img_arr = np.ascontiguousarray(img_arr)
+    data = img_arr.reshape(-1).view(np.uint8)
+
+    session_id = server.begin_upload(img_arr.dtype.str, list(img_arr.shape))
+    try:
+        for offset in range(0, data.size, chunk_size):
+            chunk = data[offset:offset + chunk_size].tobytes()
+            if compression is not None:
+                chunk = wrap_payload(chunk, compression)
+            server.upload_chunk(session_id, offset, xmlrpc.client.Binary(chunk))
+
+        info = server.process_upload(session_id, method, *args)
+        result = np.empty(tuple(info["shape"]), dtype=np.dtype(info["dtype"]))
+        out = result.reshape(-1).view(np.uint8)
+        for offset in range(0, info["nbytes"], chunk_size):
+            chunk, _ = unwrap_payload(server.download_chunk(session_id, offset, chunk_size, compression).data)
+            out[offset:offset + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+    finally:
+        server.end_session(session_id)
+    return result, info